@@ -0,0 +1,31 @@
+import math
+import hashlib
+
+class BloomFilter:
+    """Fixed-size Bloom filter over byte strings (no false negatives, tunable false positives)"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        # Standard sizing: m = -n*ln(p)/ln(2)^2 bits, k = m/n*ln(2) hash functions
+        self._num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self._num_hashes = max(1, int(round(self._num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self._num_bits + 7) // 8)
+
+    def _positions(self, item: bytes):
+        """Bit positions for item via double hashing of one blake2b digest"""
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self._num_hashes):
+            yield (h1 + i * h2) % self._num_bits
+
+    def add(self, item: bytes) -> None:
+        """Insert item into the filter"""
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def clear(self) -> None:
+        """Remove all items"""
+        self._bits = bytearray(len(self._bits))
@@ -1,5 +1,6 @@
 import os
 import logging
+from typing import ClassVar, FrozenSet
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -7,28 +8,57 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+def file_extension(filename: str) -> str:
+    """Lowercase extension of filename without the leading dot ('' if none)"""
+    _, dot, ext = filename.rpartition('.')
+    return ext.lower() if dot else ''
+
 class Config:
     """Centralized configuration management"""
     
+    # Lowercase extensions without the leading dot, as returned by file_extension()
+    ALLOWED_EXTENSIONS: ClassVar[FrozenSet[str]] = frozenset({'pdf', 'txt', 'docx', 'doc', 'csv', 'md'})
+    ALLOWED_EXTENSIONS_MSG: ClassVar[str] = "Allowed types: " + ", ".join("." + ext for ext in sorted(ALLOWED_EXTENSIONS))
+    
     def __init__(self):
+        # Read the environment once through the mapping rather than repeated os.getenv calls
+        env = os.environ
+        
         # API Keys
-        self.GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+        self.GEMINI_API_KEY = env.get("GEMINI_API_KEY")
         if not self.GEMINI_API_KEY:
             logger.warning("GEMINI_API_KEY not found in environment variables")
         
         # Feature flags
-        self.LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "false").lower() == "true"
+        self.LANGSMITH_TRACING = env.get("LANGSMITH_TRACING", "false").lower() == "true"
+        self.LLM_WARMUP = env.get("LLM_WARMUP", "true").lower() == "true"
         
         # Application settings
-        self.UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
-        self.CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
-        self.MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB default
-        self.ALLOWED_EXTENSIONS = {'.pdf', '.txt', '.docx', '.doc', '.csv', '.md'}
+        self.UPLOAD_DIR = env.get("UPLOAD_DIR", "./uploads")
+        self.CHROMA_PERSIST_DIR = env.get("CHROMA_PERSIST_DIR", "./chroma_db")
+        self.MAX_FILE_SIZE = int(env.get("MAX_FILE_SIZE", "10485760"))  # 10MB default
         
         # RAG settings
-        self.CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))  # Smaller chunks
-        self.CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
-        self.SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "8"))  # Increased from 4 to 8
+        self.CHUNK_SIZE = int(env.get("CHUNK_SIZE", "500"))  # Smaller chunks
+        self.CHUNK_OVERLAP = int(env.get("CHUNK_OVERLAP", "50"))
+        self.TEXT_SPLITTER = env.get("TEXT_SPLITTER", "fast").lower()  # "fast" (fixed stride) or "recursive"
+        self.SIMILARITY_TOP_K = int(env.get("SIMILARITY_TOP_K", "8"))  # Increased from 4 to 8
+        self.MAX_CONTEXT_CHARS = int(env.get("MAX_CONTEXT_CHARS", "12000"))  # Prompt context budget
+        self.EMBED_MODEL = env.get("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")  # 384-dim
+        self.EMBED_BATCH_SIZE = int(env.get("EMBED_BATCH_SIZE", "64"))  # Chunks per embedding forward pass
+        self.EMBED_DEVICE = env.get("EMBED_DEVICE")  # cpu/cuda/mps; auto-detected when unset
+        self.EMBED_BACKEND = env.get("EMBED_BACKEND", "torch").lower()  # torch, onnx or openvino
+        self.EMBED_MODEL_FILE = env.get("EMBED_MODEL_FILE")  # e.g. onnx/model_qint8_avx512_vnni.onnx
+        embed_fp16 = env.get("EMBED_FP16")  # Unset: half precision on CUDA only
+        self.EMBED_FP16 = None if embed_fp16 is None else embed_fp16.lower() == "true"
+        # Below this a question is a miss. Unset disables the check: LangChain's Chroma relevance
+        # score (1 - d/sqrt(2) over squared L2) goes negative for weak but real matches.
+        min_relevance = env.get("MIN_RELEVANCE_SCORE")
+        self.MIN_RELEVANCE_SCORE = None if min_relevance is None else float(min_relevance)
+        
+        # Answer cache settings
+        self.ANSWER_CACHE_TTL = float(env.get("ANSWER_CACHE_TTL", "300"))  # Seconds
+        self.ANSWER_CACHE_SIZE = int(env.get("ANSWER_CACHE_SIZE", "1024"))
         
         self._validate_config()
     
@@ -0,0 +1,67 @@
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Persistent content-hash -> embedding cache backed by SQLite"""
+
+    QUERY_BATCH = 500  # Stay well under SQLite's bound-parameter limit
+
+    def __init__(self, db_path: str, namespace: str):
+        # namespace (the model name) is mixed into every key so switching models never reuses stale vectors
+        self._namespace = namespace.encode('utf-8') + b"\x00"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (hash BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha1(self._namespace + text.encode('utf-8')).digest()
+
+    def _lookup(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Fetch cached vectors for keys"""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.QUERY_BATCH):
+                batch = keys[i:i + self.QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT hash, vec FROM cache WHERE hash IN ({placeholders})", batch)
+                for key, blob in rows:
+                    vec = array('f')
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+        return found
+
+    def _store(self, items: Dict[bytes, List[float]]) -> None:
+        """Persist newly computed vectors"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (hash, vec) VALUES (?, ?)",
+                ((key, array('f', vec).tobytes()) for key, vec in items.items())
+            )
+            self._conn.commit()
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Embed texts, calling embed_fn only for texts not already cached"""
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(set(keys)))
+
+        # Encode each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        return [found[key] for key in keys]
@@ -1,22 +1,21 @@
 import os
 import shutil
+import time
+import asyncio
 import logging
-from typing import List
-from pathlib import Path
-from datetime import datetime
+from typing import List, AsyncIterator
+from uuid import uuid4
 
 import uvicorn
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware #type:ignore
+import aiofiles
 
-from config import config
+from config import config, file_extension
 from models import FileUploadResponse, AnswerResponse, HealthResponse
-from vectorstore import vector_store_manager
-from rag import answer_question
+from vectorstore import get_vector_store_manager
+from rag import answer_question, warmup as warmup_llm
+from ratelimit import TokenBucket
 
 # Configure logging
 logging.basicConfig(
@@ -32,10 +31,10 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Rate limiting - FIXED: Use correct initialization
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+# Rate limiting - per-client token buckets
+BUCKET_UPLOAD = TokenBucket(capacity=10, rate=10 / 60)  # 10/minute
+BUCKET_RESET = TokenBucket(capacity=5, rate=5 / 60)  # 5/minute
+BUCKET_ASK = TokenBucket(capacity=30, rate=30 / 60)  # 30/minute
 
 # CORS middleware
 app.add_middleware(
@@ -47,30 +46,162 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Cached listing of UPLOAD_DIR, kept in sync by the upload endpoints
+uploaded_files_cache: List[str] = []
+uploaded_files_lock = asyncio.Lock()
+
+async def refresh_uploaded_files() -> List[str]:
+    """Re-read UPLOAD_DIR into the cached file listing"""
+    async with uploaded_files_lock:
+        # Skip hidden in-progress .part files written by stream_to_disk
+        uploaded_files_cache[:] = [name for name in os.listdir(config.UPLOAD_DIR) if not name.startswith(".")]
+        return list(uploaded_files_cache)
+
+async def record_uploaded_files(file_paths: List[str]) -> None:
+    """Add saved files to the cached listing"""
+    async with uploaded_files_lock:
+        for path in file_paths:
+            name = os.path.basename(path)
+            if name not in uploaded_files_cache:
+                uploaded_files_cache.append(name)
+
+@app.on_event("startup")
+async def load_uploaded_files():
+    """Populate the uploaded file listing from disk"""
+    await refresh_uploaded_files()
+
+@app.on_event("startup")
+async def load_vector_store():
+    """Build the vector store manager (embedding model, Chroma client) before the first request"""
+    await asyncio.to_thread(get_vector_store_manager)
+
+@app.on_event("startup")
+async def warm_up_llm():
+    """Open the shared Gemini connection before the first request arrives"""
+    if config.LLM_WARMUP:
+        # ainvoke builds the async gRPC channel inside the running loop, so warm it here
+        await warmup_llm()
+
+def utc_timestamp() -> str:
+    """Current UTC time as an ISO-8601 string"""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
 def secure_filename(filename: str) -> str:
     """Sanitize filename to prevent path traversal attacks"""
-    return Path(filename).name
+    return os.path.basename(filename).replace("\x00", "")
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB read/write blocks
 
-def validate_file_size(file: UploadFile) -> None:
-    """Validate file size"""
-    # Get file size by seeking to end
-    file.file.seek(0, 2)  # Seek to end
-    file_size = file.file.tell()
-    file.file.seek(0)  # Reset to beginning
+def file_too_large(filename: str) -> HTTPException:
+    """Build the error raised when an upload exceeds MAX_FILE_SIZE"""
+    return HTTPException(
+        status_code=400,
+        detail=f"File {filename} exceeds maximum size of {config.MAX_FILE_SIZE} bytes"
+    )
+
+async def stream_to_disk(chunks: AsyncIterator[bytes], path: str, filename: str) -> int:
+    """Write an async stream of chunks to disk, enforcing MAX_FILE_SIZE on the fly"""
+    # The size is only known at the end, so write to a hidden temp file next to path and
+    # move it into place on success; a rejected upload never touches an existing file
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid4().hex[:8]}.part")
+    total = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in chunks:
+                total += len(chunk)
+                if config.MAX_FILE_SIZE and total > config.MAX_FILE_SIZE:
+                    raise file_too_large(filename)
+                await f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Don't leave a partial file behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return total
+
+async def iter_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    """Yield an UploadFile's body in UPLOAD_CHUNK_SIZE blocks"""
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+def copy_spooled_upload(file: UploadFile, path: str, filename: str) -> int:
+    """Copy an UploadFile's spooled body to disk in kernel space (sendfile where available)"""
+    src = file.file
+    src.rollover()  # Force the SpooledTemporaryFile onto disk so it has a real fd
+    src_fd = src.fileno()
+    size = os.fstat(src_fd).st_size
+    if config.MAX_FILE_SIZE and size > config.MAX_FILE_SIZE:
+        raise file_too_large(filename)
     
-    if config.MAX_FILE_SIZE and file_size > config.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"File {file.filename} exceeds maximum size of {config.MAX_FILE_SIZE} bytes"
-        )
+    try:
+        with open(path, "wb") as dst:
+            if hasattr(os, "sendfile"):
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(dst.fileno(), src_fd, offset, size - offset)
+                    if not sent:
+                        break
+                    offset += sent
+            else:
+                src.seek(0)
+                shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+    except Exception:
+        # Don't leave a partial file behind
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return size
+
+async def save_upload(file: UploadFile) -> str:
+    """Validate and copy a single uploaded file into UPLOAD_DIR"""
+    filename = secure_filename(file.filename)
+    validate_file_extension(filename)
+    
+    path = os.path.join(config.UPLOAD_DIR, filename)
+    if hasattr(file.file, "rollover"):
+        await asyncio.to_thread(copy_spooled_upload, file, path, filename)
+    else:
+        await stream_to_disk(iter_upload(file), path, filename)
+    logger.info("Saved file: %s", filename)
+    return path
+
+async def save_uploads(files: List[UploadFile]) -> List[str]:
+    """Save all uploaded files concurrently, returning the paths that were written"""
+    # Uploads with the same sanitized name share a target path and would be written over each
+    # other concurrently; keep only the last one, as saving them in order would
+    by_name = {}
+    for f in files:
+        by_name[secure_filename(f.filename)] = f
+    if len(by_name) < len(files):
+        logger.warning("Ignoring %d earlier upload(s) with a duplicate filename", len(files) - len(by_name))
+    files = list(by_name.values())
+    
+    results = await asyncio.gather(*(save_upload(f) for f in files), return_exceptions=True)
+    
+    file_paths = []
+    for file, result in zip(files, results):
+        if isinstance(result, HTTPException):
+            raise result
+        if isinstance(result, Exception):
+            logger.error("Failed to save file %s: %s", file.filename, result)
+            continue
+        file_paths.append(result)
+    return file_paths
+
+def enforce_rate_limit(bucket: TokenBucket, request: Request) -> None:
+    """Reject the request with 429 if the client has exhausted its bucket"""
+    client_ip = request.client.host if request.client else "unknown"
+    if not bucket.allow(client_ip):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
 
 def validate_file_extension(filename: str) -> None:
     """Validate file extension"""
-    ext = Path(filename).suffix.lower()
+    ext = file_extension(filename)
     if ext not in config.ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"File type {ext} not supported. Allowed types: {', '.join(config.ALLOWED_EXTENSIONS)}"
+            detail=f"File type .{ext} not supported. {config.ALLOWED_EXTENSIONS_MSG}"
         )
 
 @app.get("/", include_in_schema=False)
@@ -82,48 +213,35 @@ async def health_check():
     """Health check endpoint"""
     return HealthResponse(
         status="healthy",
-        timestamp=datetime.utcnow().isoformat(),
+        timestamp=utc_timestamp(),
         version="1.0.0"
     )
 
 @app.post("/admin/upload", response_model=FileUploadResponse)
-@limiter.limit("10/minute")  # FIXED: Use decorator instead of manual check
 async def upload_files(
     request: Request,
     files: List[UploadFile] = File(...)
 ):
     """Upload and process files (append to existing knowledge base)"""
+    enforce_rate_limit(BUCKET_UPLOAD, request)
+    
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
-    file_paths = []
-    processed_files = 0
-    
-    for file in files:
-        try:
-            # Security validations
-            filename = secure_filename(file.filename)
-            validate_file_extension(filename)
-            validate_file_size(file)
-            
-            # Save file
-            path = os.path.join(config.UPLOAD_DIR, filename)
-            with open(path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-            file_paths.append(path)
-            processed_files += 1
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Failed to save file {file.filename}: {e}")
-            continue
+    try:
+        file_paths = await save_uploads(files)
+    except HTTPException:
+        # Files saved before the rejected one are on disk, so resync the listing
+        await refresh_uploaded_files()
+        raise
     
     if not file_paths:
         raise HTTPException(status_code=400, detail="No valid files to process")
     
-    # Process files with vector store
-    results = vector_store_manager.add_files(file_paths)
+    await record_uploaded_files(file_paths)
+    
+    # Process files with vector store off the event loop
+    results = await asyncio.to_thread(get_vector_store_manager().add_files, file_paths)
     
     successful = sum(1 for r in results if r['status'] == 'success')
     failed = len(results) - successful
@@ -135,54 +253,73 @@ async def upload_files(
         total_files=len(files)
     )
 
+@app.post("/admin/upload_stream", response_model=FileUploadResponse)
+async def upload_stream(request: Request):
+    """Upload a single large file as the raw request body (filename in X-Filename header)"""
+    enforce_rate_limit(BUCKET_UPLOAD, request)
+    
+    raw_name = request.headers.get("x-filename")
+    if not raw_name:
+        raise HTTPException(status_code=400, detail="X-Filename header is required")
+    
+    filename = secure_filename(raw_name)
+    validate_file_extension(filename)
+    
+    path = os.path.join(config.UPLOAD_DIR, filename)
+    try:
+        await stream_to_disk(request.stream(), path, filename)
+    except Exception:
+        await refresh_uploaded_files()
+        raise
+    await record_uploaded_files([path])
+    
+    results = await asyncio.to_thread(get_vector_store_manager().add_files, [path])
+    
+    successful = sum(1 for r in results if r['status'] == 'success')
+    failed = len(results) - successful
+    
+    return FileUploadResponse(
+        message=f"Processed {successful} files successfully, {failed} failed",
+        processed_files=successful,
+        failed_files=failed,
+        total_files=1
+    )
+
 @app.post("/admin/reset_upload", response_model=FileUploadResponse)
-@limiter.limit("5/minute")  # FIXED: Use decorator
 async def reset_upload(
     request: Request,
     files: List[UploadFile] = File(...)
 ):
     """Clear knowledge base and upload new files"""
+    enforce_rate_limit(BUCKET_RESET, request)
+    
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
     # FIRST: Clear the upload directory before saving new files
     logger.info("Clearing existing upload directory...")
-    for existing_file in os.listdir(config.UPLOAD_DIR):
-        try:
-            os.remove(os.path.join(config.UPLOAD_DIR, existing_file))
-            logger.info(f"Removed existing file: {existing_file}")
-        except Exception as e:
-            logger.warning(f"Failed to remove {existing_file}: {e}")
-    
-    # SECOND: Save new files
-    file_paths = []
-    processed_files = 0
-    
-    for file in files:
-        try:
-            filename = secure_filename(file.filename)
-            validate_file_extension(filename)
-            validate_file_size(file)
-            
-            path = os.path.join(config.UPLOAD_DIR, filename)
-            with open(path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-            file_paths.append(path)
-            processed_files += 1
-            logger.info(f"Saved new file: {filename}")
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Failed to save file {file.filename}: {e}")
-            continue
+    removed = 0
+    with os.scandir(config.UPLOAD_DIR) as entries:
+        for entry in entries:
+            try:
+                os.unlink(entry.path)
+                removed += 1
+            except OSError as e:
+                logger.warning("Failed to remove %s: %s", entry.name, e)
+    logger.info("Cleared %d existing files", removed)
+    
+    # SECOND: Save new files, resyncing the listing with disk even if a file is rejected
+    try:
+        file_paths = await save_uploads(files)
+    finally:
+        await refresh_uploaded_files()
     
     if not file_paths:
         raise HTTPException(status_code=400, detail="No valid files to process")
     
     # THIRD: Reset vector store and add new files
-    logger.info(f"Starting vector store reset with {len(file_paths)} files")
-    results = vector_store_manager.reset_and_add_files(file_paths)
+    logger.info("Starting vector store reset with %d files", len(file_paths))
+    results = await asyncio.to_thread(get_vector_store_manager().reset_and_add_files, file_paths)
     
     successful = sum(1 for r in results if r['status'] == 'success')
     failed = len(results) - successful
@@ -195,44 +332,66 @@ async def reset_upload(
     )
 
 @app.get("/ask")
-@limiter.limit("30/minute")  # FIXED: Use decorator
 async def ask_question(
     request: Request,
     question: str
 ):
     """Ask a question to the RAG system"""
+    enforce_rate_limit(BUCKET_ASK, request)
+    
     if not question or not question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty")
     
     if len(question) > 1000:
         raise HTTPException(status_code=400, detail="Question too long")
     
-    result = answer_question(question)
+    result = await answer_question(question)
     return AnswerResponse(**result)
 
 @app.get("/admin/status")
 async def get_system_status():
     """Get system status and vector store information"""
     try:
-        collection_info = vector_store_manager.get_collection_info()
-        upload_files = os.listdir(config.UPLOAD_DIR)
+        collection_info = get_vector_store_manager().get_collection_info()
         
         return {
             "status": "operational",
             "vector_store": collection_info,
-            "uploaded_files": upload_files,
+            "uploaded_files": list(uploaded_files_cache),
             "upload_dir": config.UPLOAD_DIR,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": utc_timestamp()
         }
     except Exception as e:
-        logger.error(f"Status check failed: {e}")
+        logger.error("Status check failed: %s", e)
         raise HTTPException(status_code=500, detail="Status check failed")
 
-if __name__ == "__main__":
+@app.post("/admin/status/refresh")
+async def refresh_system_status():
+    """Resync the cached uploaded file listing with the upload directory"""
+    try:
+        upload_files = await refresh_uploaded_files()
+        return {
+            "uploaded_files": upload_files,
+            "timestamp": utc_timestamp()
+        }
+    except Exception as e:
+        logger.error("Status refresh failed: %s", e)
+        raise HTTPException(status_code=500, detail="Status refresh failed")
+
+def run() -> None:
+    """Start the API server (PROD=1 disables the reloader)"""
+    # Always a single worker: the embedded Chroma PersistentClient is not process-safe.
+    # Loop/HTTP "auto" picks uvloop and httptools when installed, falling back to asyncio/h11.
+    prod = os.getenv("PROD", "0") == "1"
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=not prod,
+        loop="auto",
+        http="auto",
         log_level="info"
-    )
\ No newline at end of file
+    )
+
+if __name__ == "__main__":
+    run()
@@ -1,23 +1,55 @@
+import asyncio
+import hashlib
 import logging
 import time
-from typing import List, Tuple
-from datetime import datetime
+import threading
+from collections import defaultdict, OrderedDict
+from functools import lru_cache
+from typing import List, Tuple, Dict, Optional
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema import Document
-from langchain.prompts import PromptTemplate
+from langchain.schema import Document, SystemMessage, HumanMessage
 
 from config import config
-from vectorstore import vector_store_manager
+from vectorstore import get_vector_store_manager
+from bloom import BloomFilter
 
 logger = logging.getLogger(__name__)
 
+GENERATION_ERROR_ANSWER = "I apologize, but I encountered an error while generating the answer. Please try again later."
+NO_CONTEXT_ANSWER = "I couldn't find relevant information in the knowledge base to answer your question. Please try rephrasing or ask about something else."
+
+def normalize_question(question: str) -> str:
+    """Canonical form of a question used for cache and miss-filter lookups"""
+    return question.strip().lower()
+
+def miss_key(question: str) -> bytes:
+    """Compact hash of a normalized question for the miss filter"""
+    return hashlib.blake2b(normalize_question(question).encode(), digest_size=8).digest()
+
 class RAGSystem:
     """Enhanced RAG system with better multi-file retrieval"""
     
     def __init__(self):
-        self.llm = self._initialize_llm()
-        self.prompt = self._initialize_prompt()
+        self._llm = None  # Created lazily on first use to keep startup cheap
+        self._system_message, self._prompt_prefix, self._prompt_mid, self._prompt_suffix = self._initialize_prompt()
+        
+        # Answer cache: normalized question -> (cached_at, result), kept in LRU order
+        self._cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        # invalidate() runs on the ingest worker thread, so cache access is locked and every
+        # invalidation bumps the generation to keep in-flight answers from the old store out
+        self._cache_lock = threading.Lock()
+        self._generation = 0
+        # Questions whose best match scored below MIN_RELEVANCE_SCORE
+        self._miss_filter = BloomFilter(capacity=100_000, error_rate=0.01)
+        get_vector_store_manager().register_change_listener(self.invalidate)
+    
+    @property
+    def llm(self) -> ChatGoogleGenerativeAI:
+        """Language model, initialized on first access"""
+        if self._llm is None:
+            self._llm = self._initialize_llm()
+        return self._llm
     
     def _initialize_llm(self) -> ChatGoogleGenerativeAI:
         """Initialize the language model"""
@@ -29,112 +61,154 @@ class RAGSystem:
                 max_tokens=1500  # Increased for more comprehensive answers
             )
         except Exception as e:
-            logger.error(f"Failed to initialize LLM: {e}")
+            logger.error("Failed to initialize LLM: %s", e)
             raise
     
-    def _initialize_prompt(self):
-        """Initialize the prompt template with better instructions"""
-        template = """You are an AI assistant that helps with supplier and company information. 
-        Use the following context from multiple sources to provide a comprehensive answer.
-
-        CONTEXT FROM VARIOUS SOURCES:
-        {context}
-
-        QUESTION: {question}
+    def _initialize_prompt(self) -> Tuple[SystemMessage, str, str, str]:
+        """Initialize the system instruction and the user template, pre-split around {context} and {question}"""
+        # Static role and instructions go to Gemini's system_instruction, not the user turn
+        system_message = SystemMessage(content="""You are an AI assistant that helps with supplier and company information.
+        Use the context from multiple sources provided by the user to answer their question.
 
         INSTRUCTIONS:
         1. Synthesize information from ALL relevant sources
         2. If different sources have conflicting information, mention this
         3. Provide a comprehensive answer that considers all available data
-        4. If you cannot find specific information, say so but still use what you have
+        4. If you cannot find specific information, say so but still use what you have""")
+        
+        template = """CONTEXT FROM VARIOUS SOURCES:
+        {context}
+
+        QUESTION: {question}
 
         COMPREHENSIVE ANSWER:"""
         
-        return PromptTemplate(
-            template=template,
-            input_variables=["context", "question"]
-        )
+        prefix, rest = template.split("{context}", 1)
+        mid, suffix = rest.split("{question}", 1)
+        return system_message, prefix, mid, suffix
     
-    def retrieve(self, question: str) -> Tuple[List[Document], List[str]]:
-        """Retrieve relevant documents from ALL files with enhanced search"""
+    async def warmup(self) -> None:
+        """Create the LLM client and open its async channel (the one /ask uses) so the first /ask doesn't pay for it"""
+        try:
+            await self.llm.ainvoke("ping")
+            logger.info("LLM connection warmed up")
+        except Exception as e:
+            logger.warning("LLM warmup failed: %s", e)
+    
+    async def retrieve(self, question: str) -> Tuple[List[Document], List[str]]:
+        """Retrieve relevant documents from ALL files with enhanced search (raises if the search fails)"""
         try:
             # Use a larger k value to get more diverse results
             k = min(12, config.SIMILARITY_TOP_K * 2)  # Get more documents for better coverage
             
-            documents = vector_store_manager.similarity_search(question, k=k)
-            sources = list(set([doc.metadata.get('source', 'Unknown') for doc in documents]))
+            # Chroma calls are synchronous, so keep them off the event loop
+            generation = self._generation
+            min_score = config.MIN_RELEVANCE_SCORE
+            if min_score is None:
+                # No cutoff: skip relevance scoring, which warns on every score outside [0, 1]
+                documents = await asyncio.to_thread(get_vector_store_manager().similarity_search, question, k=k)
+            else:
+                scored = await asyncio.to_thread(get_vector_store_manager().similarity_search_with_scores, question, k=k)
+                if scored and scored[0][1] < min_score:
+                    if generation == self._generation:
+                        logger.info("Best match scored %.3f, below MIN_RELEVANCE_SCORE; recording miss", scored[0][1])
+                        self._miss_filter.add(miss_key(question))
+                    return [], []
+                documents = [doc for doc, _ in scored]
+            sources = list({doc.metadata.get('source', 'Unknown') for doc in documents})
             
-            logger.info(f"🔍 Retrieved {len(documents)} documents from {len(sources)} unique sources: {sources}")
+            logger.info("🔍 Retrieved %d documents from %d unique sources: %s", len(documents), len(sources), sources)
             
             # If we have documents but from only one source, try to get more diversity
             if len(sources) == 1 and len(documents) > 3:
                 logger.info("Only one source found, attempting to get more diverse results...")
-                # Try with a different approach - get some random documents too
                 try:
-                    # Get a few random documents to increase diversity
-                    all_docs = vector_store_manager.vector_store.get()
-                    if all_docs and 'documents' in all_docs:
-                        total_docs = len(all_docs['documents'])
-                        if total_docs > len(documents):
-                            # Add some random documents from other sources
-                            import random
-                            other_docs = []
-                            for doc in all_docs['documents']:
-                                doc_source = doc.metadata.get('source', 'Unknown') if hasattr(doc, 'metadata') else 'Unknown'
-                                if doc_source not in sources:
-                                    other_docs.append(doc)
-                            
-                            if other_docs:
-                                # Add 2-3 random documents from other sources
-                                random_samples = random.sample(other_docs, min(3, len(other_docs)))
-                                documents.extend(random_samples)
-                                sources = list(set([doc.metadata.get('source', 'Unknown') for doc in documents]))
-                                logger.info(f"Added {len(random_samples)} random documents, now have {len(sources)} sources")
+                    # Let Chroma filter out the already-seen source instead of scanning every document
+                    extra_docs = await asyncio.to_thread(
+                        get_vector_store_manager().similarity_search,
+                        question, k=3, filter={"source": {"$nin": sources}}
+                    )
+                    if extra_docs:
+                        documents.extend(extra_docs)
+                        sources = list({doc.metadata.get('source', 'Unknown') for doc in documents})
+                        logger.info("Added %d documents from other sources, now have %d sources", len(extra_docs), len(sources))
                 except Exception as e:
-                    logger.warning(f"Could not add diverse documents: {e}")
+                    logger.warning("Could not add diverse documents: %s", e)
             
             return documents, sources
         except Exception as e:
-            logger.error(f"Retrieval failed: {e}")
-            return [], []
+            # Propagate so a transient failure isn't cached or answered as "no relevant information"
+            logger.error("Retrieval failed: %s", e)
+            raise
     
-    def generate(self, question: str, context_docs: List[Document]) -> str:
-        """Generate answer using context documents from multiple sources"""
+    async def generate(self, question: str, context_docs: List[Document]) -> Tuple[str, bool]:
+        """Generate answer using context documents from multiple sources, returning (answer, succeeded)"""
         if not context_docs:
-            return "I couldn't find relevant information in the knowledge base to answer your question. Please try rephrasing or ask about something else."
+            return NO_CONTEXT_ANSWER, True
         
         try:
-            # Organize context by source for better synthesis
-            context_by_source = {}
+            # Take documents in retrieval order until the context budget is spent,
+            # organizing them by source for better synthesis
+            context_by_source = defaultdict(list)
+            used_chars = 0
             for doc in context_docs:
-                source = doc.metadata.get('source', 'Unknown')
-                if source not in context_by_source:
-                    context_by_source[source] = []
-                context_by_source[source].append(doc.page_content)
+                if context_by_source and used_chars + len(doc.page_content) > config.MAX_CONTEXT_CHARS:
+                    break
+                context_by_source[doc.metadata.get('source', 'Unknown')].append(doc.page_content)
+                used_chars += len(doc.page_content)
             
             # Build comprehensive context text
             context_sections = []
             for source, contents in context_by_source.items():
-                source_content = "\n".join([f"- {content}" for content in contents[:3]])  # Limit per source
+                source_content = "\n".join("- " + content for content in contents)
                 context_sections.append(f"FROM {source}:\n{source_content}")
             
             context_text = "\n\n".join(context_sections)
             
-            logger.info(f"📚 Using context from {len(context_by_source)} sources: {list(context_by_source.keys())}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("📚 Using context from %d sources: %s", len(context_by_source), list(context_by_source))
             
-            prompt_text = self.prompt.format(
-                context=context_text,
-                question=question
-            )
+            prompt_text = f"{self._prompt_prefix}{context_text}{self._prompt_mid}{question}{self._prompt_suffix}"
             
-            response = self.llm.invoke(prompt_text)
-            return response.content.strip()
+            response = await self.llm.ainvoke([self._system_message, HumanMessage(content=prompt_text)])
+            return response.content.strip(), True
             
         except Exception as e:
-            logger.error(f"Generation failed: {e}")
-            return "I apologize, but I encountered an error while generating the answer. Please try again later."
+            logger.error("Generation failed: %s", e)
+            return GENERATION_ERROR_ANSWER, False
+    
+    def invalidate(self) -> None:
+        """Drop all cached answers and known misses (called whenever the knowledge base changes)"""
+        with self._cache_lock:
+            self._generation += 1
+            self._cache.clear()
+            self._miss_filter.clear()
+        logger.info("Answer cache invalidated")
     
-    def answer_question(self, question: str) -> dict:
+    def _cache_get(self, key: str) -> Optional[dict]:
+        """Return a fresh cached answer for key, if any"""
+        with self._cache_lock:
+            hit = self._cache.get(key)
+            if hit is None:
+                return None
+            cached_at, result = hit
+            if time.monotonic() - cached_at >= config.ANSWER_CACHE_TTL:
+                self._cache.pop(key, None)
+                return None
+            self._cache.move_to_end(key)
+            return result
+    
+    def _cache_put(self, key: str, result: dict, generation: int) -> None:
+        """Store an answer unless the knowledge base changed since generation, evicting LRU entries past ANSWER_CACHE_SIZE"""
+        with self._cache_lock:
+            if generation != self._generation:
+                return
+            self._cache[key] = (time.monotonic(), result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > config.ANSWER_CACHE_SIZE:
+                self._cache.popitem(last=False)
+    
+    async def answer_question(self, question: str) -> dict:
         """Main RAG pipeline with enhanced multi-source retrieval"""
         start_time = time.time()
         
@@ -145,24 +219,43 @@ class RAGSystem:
                 "processing_time": 0.0
             }
         
+        if miss_key(question) in self._miss_filter:
+            logger.info("Question is a known miss, skipping retrieval and generation")
+            return {
+                "answer": NO_CONTEXT_ANSWER,
+                "sources": [],
+                "processing_time": round(time.time() - start_time, 2),
+                "documents_used": 0
+            }
+        
+        cache_key = normalize_question(question)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.info("Answer cache hit")
+            return {**cached, "processing_time": round(time.time() - start_time, 2)}
+        
+        generation = self._generation
         try:
-            # Retrieve relevant documents from ALL sources
-            context_docs, sources = self.retrieve(question)
+            # Retrieve relevant documents from ALL sources (a failed search raises and is never cached)
+            context_docs, sources = await self.retrieve(question)
             
             # Generate comprehensive answer
-            answer = self.generate(question, context_docs)
+            answer, generated = await self.generate(question, context_docs)
             
             processing_time = time.time() - start_time
             
-            return {
+            result = {
                 "answer": answer,
                 "sources": sources,
                 "processing_time": round(processing_time, 2),
                 "documents_used": len(context_docs)
             }
+            if generated:
+                self._cache_put(cache_key, result, generation)
+            return result
             
         except Exception as e:
-            logger.error(f"RAG pipeline failed: {e}")
+            logger.error("RAG pipeline failed: %s", e)
             processing_time = time.time() - start_time
             return {
                 "answer": "I'm sorry, but I encountered an unexpected error while processing your question.",
@@ -171,9 +264,15 @@ class RAGSystem:
                 "documents_used": 0
             }
 
-# Global RAG system instance
-rag_system = RAGSystem()
+@lru_cache(maxsize=1)
+def get_rag() -> RAGSystem:
+    """Global RAG system instance, created on first use"""
+    return RAGSystem()
 
-def answer_question(question: str) -> dict:
+async def answer_question(question: str) -> dict:
     """Public interface for answering questions"""
-    return rag_system.answer_question(question)
\ No newline at end of file
+    return await get_rag().answer_question(question)
+
+async def warmup() -> None:
+    """Public interface for warming up the LLM connection"""
+    await get_rag().warmup()
\ No newline at end of file
@@ -0,0 +1,37 @@
+import time
+import threading
+from typing import Dict, Tuple
+
+class TokenBucket:
+    """In-process token-bucket rate limiter keyed on an arbitrary string (e.g. client IP)"""
+
+    SWEEP_INTERVAL = 60.0  # Seconds between sweeps for buckets that have refilled
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate  # Tokens refilled per second
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, last_refill)
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now: float) -> None:
+        """Drop buckets that have refilled to capacity (a missing key starts full anyway); caller holds _lock"""
+        self._buckets = {
+            key: (tokens, last) for key, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * self.rate < self.capacity
+        }
+        self._last_sweep = now
+
+    def allow(self, key: str, cost: float = 1) -> bool:
+        """Consume `cost` tokens for `key`, returning False if not enough are available"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep >= self.SWEEP_INTERVAL:
+                self._sweep(now)
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - cost, now)
+            return True
@@ -1,25 +1,38 @@
 import os
 import logging
 import csv
+import mmap
+import multiprocessing
+import hashlib
 import time
-from typing import List
+import threading
+from typing import List, Optional, Callable, Tuple
 from pathlib import Path
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
 
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import Chroma
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-from config import config
+from config import config, file_extension
+from embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+COLLECTION_NAME = "rag_collection"
+
+# PDFium is not thread-safe (even across documents), so every pypdfium2 call goes through this lock
+_pdfium_lock = threading.Lock()
+
 class DocumentLoader:
     """Simplified document loader without external dependencies"""
     
     def load_document(self, file_path: str) -> List[Document]:
         """Load a document using basic file reading"""
-        ext = Path(file_path).suffix.lower()
+        ext = file_extension(file_path)
         
         if ext not in config.ALLOWED_EXTENSIONS:
             raise ValueError(f"Unsupported file type: {ext}")
@@ -27,11 +40,11 @@ class DocumentLoader:
         logger.info(f"Loading document: {file_path} (type: {ext})")
         
         try:
-            if ext == '.pdf':
+            if ext == 'pdf':
                 return self._load_pdf(file_path)
-            elif ext == '.csv':
+            elif ext == 'csv':
                 return self._load_csv(file_path)
-            elif ext in ['.docx', '.doc']:
+            elif ext in ('docx', 'doc'):
                 return self._load_docx(file_path)
             else:  # .txt, .md, etc.
                 return self._load_text(file_path)
@@ -40,42 +53,67 @@ class DocumentLoader:
             # Fallback to text loading
             return self._load_text(file_path)
     
+    def _base_metadata(self, file_path: str) -> dict:
+        """Metadata shared by every document loaded from file_path"""
+        return {
+            "source": Path(file_path).name,
+            "file_path": file_path
+        }
+    
     def _load_text(self, file_path: str) -> List[Document]:
-        """Load text file"""
+        """Load text file (read once in 1MB blocks, then decode)"""
+        buffer = bytearray()
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            while block := os.read(fd, 1 << 20):
+                buffer += block
+        finally:
+            os.close(fd)
+        
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-                metadata = {
-                    "source": Path(file_path).name,
-                    "file_path": file_path
-                }
-                return [Document(page_content=content, metadata=metadata)]
+            content = buffer.decode('utf-8')
         except UnicodeDecodeError:
             # Try different encoding
-            with open(file_path, 'r', encoding='latin-1') as file:
-                content = file.read()
-                metadata = {
-                    "source": Path(file_path).name,
-                    "file_path": file_path
-                }
-                return [Document(page_content=content, metadata=metadata)]
+            content = buffer.decode('latin-1')
+        return [Document(page_content=content, metadata=self._base_metadata(file_path))]
     
     def _load_pdf(self, file_path: str) -> List[Document]:
-        """Load PDF file using PyPDF2"""
+        """Load PDF file using pypdfium2 (native PDFium), falling back to PyPDF2"""
+        try:
+            import pypdfium2 as pdfium
+        except ImportError:
+            logger.warning("pypdfium2 not available, falling back to PyPDF2")
+            return self._load_pdf_pypdf2(file_path)
+        
+        documents = []
+        base_metadata = self._base_metadata(file_path)
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(file_path)
+            try:
+                for page_num, page in enumerate(pdf, start=1):
+                    textpage = page.get_textpage()
+                    text = textpage.get_text_range()
+                    textpage.close()
+                    page.close()
+                    if text.strip():
+                        documents.append(Document(page_content=text, metadata={**base_metadata, "page": page_num}))
+            finally:
+                pdf.close()
+        return documents
+    
+    def _load_pdf_pypdf2(self, file_path: str) -> List[Document]:
+        """Load PDF file using PyPDF2 over a read-only memory map"""
         try:
             import PyPDF2
             documents = []
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
+            base_metadata = self._base_metadata(file_path)
+            # mmap is seekable and file-like, so pages are paged in by the kernel on demand
+            with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pdf_reader = PyPDF2.PdfReader(mm)
                 for page_num, page in enumerate(pdf_reader.pages, start=1):
                     text = page.extract_text()
                     if text.strip():
-                        metadata = {
-                            "source": Path(file_path).name,
-                            "file_path": file_path,
-                            "page": page_num
-                        }
-                        documents.append(Document(page_content=text, metadata=metadata))
+                        documents.append(Document(page_content=text, metadata={**base_metadata, "page": page_num}))
             return documents
         except ImportError:
             logger.warning("PyPDF2 not available, using text extraction fallback")
@@ -84,48 +122,34 @@ class DocumentLoader:
     def _load_csv(self, file_path: str) -> List[Document]:
         """Load CSV file - optimized for large files"""
         documents = []
+        base_metadata = self._base_metadata(file_path)
         try:
             with open(file_path, 'r', encoding='utf-8', newline='') as file:
                 # Try to detect dialect
                 sample = file.read(1024)
                 file.seek(0)
                 
+                sniffer = csv.Sniffer()
                 try:
-                    dialect = csv.Sniffer().sniff(sample)
-                    has_header = csv.Sniffer().has_header(sample)
-                except:
+                    dialect = sniffer.sniff(sample)
+                    has_header = sniffer.has_header(sample)
+                except csv.Error:
                     dialect = csv.excel
                     has_header = True
                 
-                if has_header:
-                    reader = csv.DictReader(file, dialect=dialect)
-                    for i, row in enumerate(reader, start=1):
-                        # Limit row processing for very large files
-                        if i > 1000:  # Process max 1000 rows to avoid huge vectors
-                            logger.warning(f"CSV file too large, processing first 1000 rows only")
-                            break
-                            
-                        content = "\n".join([f"{key}: {value}" for key, value in row.items() if value])
-                        metadata = {
-                            "source": Path(file_path).name,
-                            "row": i,
-                            "file_path": file_path
-                        }
-                        documents.append(Document(page_content=content, metadata=metadata))
-                else:
-                    reader = csv.reader(file, dialect=dialect)
-                    for i, row in enumerate(reader, start=1):
-                        if i > 1000:
-                            logger.warning(f"CSV file too large, processing first 1000 rows only")
-                            break
-                            
-                        content = " | ".join([f"Column {idx}: {value}" for idx, value in enumerate(row, start=1) if value])
-                        metadata = {
-                            "source": Path(file_path).name,
-                            "row": i,
-                            "file_path": file_path
-                        }
-                        documents.append(Document(page_content=content, metadata=metadata))
+                reader = csv.reader(file, dialect=dialect)
+                header = next(reader, None) if has_header else None
+                for i, row in enumerate(reader, start=1):
+                    # Limit row processing for very large files
+                    if i > 1000:  # Process max 1000 rows to avoid huge vectors
+                        logger.warning(f"CSV file too large, processing first 1000 rows only")
+                        break
+                    
+                    if header is not None:
+                        content = "\n".join(f"{key}: {value}" for key, value in zip(header, row) if value)
+                    else:
+                        content = " | ".join(f"Column {idx}: {value}" for idx, value in enumerate(row, start=1) if value)
+                    documents.append(Document(page_content=content, metadata={**base_metadata, "row": i}))
         except Exception as e:
             logger.error(f"CSV loading failed for {file_path}: {e}")
             # Fallback to text
@@ -137,190 +161,461 @@ class DocumentLoader:
         """Load DOCX file using python-docx"""
         try:
             import docx
-            documents = []
             doc = docx.Document(file_path)
             content = "\n".join([paragraph.text for paragraph in doc.paragraphs if paragraph.text.strip()])
-            metadata = {
-                "source": Path(file_path).name,
-                "file_path": file_path
-            }
-            return [Document(page_content=content, metadata=metadata)]
+            return [Document(page_content=content, metadata=self._base_metadata(file_path))]
         except ImportError:
             logger.warning("python-docx not available, using text extraction fallback")
             return self._load_text(file_path)
 
+def chunk_hash(chunk: Document) -> str:
+    """Deterministic id for a chunk from its source and text"""
+    key = f"{chunk.metadata.get('source', '')}\x00{chunk.page_content}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+class FastTextSplitter:
+    """Fixed-stride character splitter (no separator search), a drop-in for split_documents"""
+    
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+    
+    def split_text(self, text: str) -> List[str]:
+        """Slice text into chunk_size windows that overlap by chunk_overlap characters"""
+        step = self.chunk_size - self.chunk_overlap
+        chunks = (text[i:i + self.chunk_size] for i in range(0, max(len(text) - self.chunk_overlap, 1), step))
+        return [chunk for chunk in chunks if chunk.strip()]
+    
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        """Split each document, copying its metadata and numbering chunks with chunk_id"""
+        chunks = []
+        for doc in documents:
+            for chunk_id, text in enumerate(self.split_text(doc.page_content)):
+                chunks.append(Document(page_content=text, metadata={**doc.metadata, "chunk_id": chunk_id}))
+        return chunks
+
+def detect_device() -> str:
+    """Pick the fastest available torch device for embeddings (config.EMBED_DEVICE overrides)"""
+    if config.EMBED_DEVICE:
+        return config.EMBED_DEVICE
+    
+    import torch
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
 class VectorStoreManager:
     """Manages vector store operations"""
     
+    DOC_COUNT_TTL = 30.0  # Seconds; bounds staleness when another process writes to the store
+    
     def __init__(self):
         logger.info("Initializing VectorStoreManager...")
         
         # Initialize embeddings
         try:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-mpnet-base-v2",
-                model_kwargs={'device': 'cpu'}
-            )
-            logger.info("Embeddings initialized successfully")
+            device = detect_device()
+            if device == 'cpu':
+                import torch
+                torch.set_num_threads(min(8, os.cpu_count() or 1))
+            
+            self.embed_backend = config.EMBED_BACKEND  # Set to 'torch' by _create_embeddings on fallback
+            self.embeddings = self._create_embeddings(device)
+            
+            use_fp16 = config.EMBED_FP16 if config.EMBED_FP16 is not None else device == 'cuda'
+            use_fp16 = use_fp16 and self.embed_backend == 'torch'
+            if use_fp16:
+                self.embeddings.client.half()
+                logger.info("Embedding model converted to FP16")
+            logger.info(f"Embeddings initialized successfully on {device}")
         except Exception as e:
             logger.error(f"Failed to initialize embeddings: {e}")
             raise
         
+        # Warm up both the query and batched code paths so the first request doesn't pay for it
+        try:
+            self.embeddings.embed_query("warmup")
+            self.embeddings.embed_documents(["a", "b"])
+            logger.info("Embedding model warmed up")
+        except Exception as e:
+            logger.warning(f"Embedding warmup failed: {e}")
+        
         # Initialize vector store
         try:
-            self.vector_store = Chroma(
-                collection_name="rag_collection",
-                embedding_function=self.embeddings,
-                persist_directory=config.CHROMA_PERSIST_DIR,
-            )
+            self.vector_store = self._open_store(COLLECTION_NAME)
             logger.info("Vector store initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize vector store: {e}")
             raise
         
-        self.document_loader = DocumentLoader()
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,  # Reduced for better performance
-            chunk_overlap=50,
-            length_function=len,
+        self._change_listeners: List[Callable[[], None]] = []
+        self._write_lock = threading.Lock()  # Serializes ingest; Chroma's writer is not thread-safe
+        self._doc_count: Optional[int] = None  # Cached collection size, cleared on every write
+        self._doc_count_at = 0.0  # time.monotonic() when _doc_count was read
+        try:
+            logger.info(f"Vector store has {self.document_count()} documents")
+        except Exception as e:
+            logger.warning(f"Could not check document count: {e}")
+        self._check_embed_model()
+        
+        # Content-hash cache so re-ingesting unchanged chunks skips the embedding model. The same
+        # model yields different vectors per backend, model file and precision, so all are in the key.
+        model_file = config.EMBED_MODEL_FILE if self.embed_backend != 'torch' else None
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(config.CHROMA_PERSIST_DIR, "emb_cache.db"),
+            namespace=f"{config.EMBED_MODEL}|{self.embed_backend}|{model_file or ''}|{'fp16' if use_fp16 else 'fp32'}"
         )
+        
+        self.document_loader = DocumentLoader()
+        if config.TEXT_SPLITTER == "recursive":
+            # Slower, but respects paragraph/sentence boundaries
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=config.CHUNK_SIZE,
+                chunk_overlap=config.CHUNK_OVERLAP,
+                length_function=len,
+            )
+        else:
+            self.text_splitter = FastTextSplitter(config.CHUNK_SIZE, config.CHUNK_OVERLAP)
     
-    def add_files(self, file_paths: List[str]) -> List[dict]:
-        """Add files to vector store with detailed results"""
-        results = []
-        all_chunks = []
+    def _create_embeddings(self, device: str) -> HuggingFaceEmbeddings:
+        """Create the embedding model, using the ONNX/OpenVINO backend when configured"""
+        model_kwargs = {'device': device}
+        if config.EMBED_BACKEND != 'torch':
+            model_kwargs['backend'] = config.EMBED_BACKEND
+            if config.EMBED_MODEL_FILE:
+                model_kwargs['model_kwargs'] = {'file_name': config.EMBED_MODEL_FILE}
         
-        for file_path in file_paths:
-            result = {
-                'filename': Path(file_path).name,
-                'status': 'success',
-                'chunks_created': 0,
-                'error': None
-            }
-            
+        try:
+            return HuggingFaceEmbeddings(
+                model_name=config.EMBED_MODEL,
+                model_kwargs=model_kwargs,
+                encode_kwargs={'batch_size': config.EMBED_BATCH_SIZE, 'normalize_embeddings': True}
+            )
+        except Exception as e:
+            if config.EMBED_BACKEND == 'torch':
+                raise
+            logger.warning(f"{config.EMBED_BACKEND} embedding backend unavailable ({e}), falling back to torch")
+            self.embed_backend = 'torch'
+            return HuggingFaceEmbeddings(
+                model_name=config.EMBED_MODEL,
+                model_kwargs={'device': device},
+                encode_kwargs={'batch_size': config.EMBED_BATCH_SIZE, 'normalize_embeddings': True}
+            )
+    
+    def _open_store(self, collection_name: str) -> Chroma:
+        """Open (creating if needed) a persisted Chroma collection"""
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=config.CHROMA_PERSIST_DIR,
+            collection_metadata={"embed_model": config.EMBED_MODEL},
+        )
+    
+    def _check_embed_model(self) -> None:
+        """Warn if the persisted collection was built with a different embedding model"""
+        try:
+            stored_model = (self.vector_store._collection.metadata or {}).get("embed_model")
+            if stored_model != config.EMBED_MODEL and self.document_count() > 0:
+                logger.warning(
+                    f"Collection was built with {stored_model or 'an older embedding model'} but "
+                    f"EMBED_MODEL is {config.EMBED_MODEL}; vectors are incompatible, "
+                    f"re-upload files through /admin/reset_upload"
+                )
+        except Exception as e:
+            logger.warning(f"Could not check collection embedding model: {e}")
+    
+    def document_count(self) -> int:
+        """Number of documents in the collection, cached until the next write or DOC_COUNT_TTL"""
+        now = time.monotonic()
+        if self._doc_count is None or now - self._doc_count_at >= self.DOC_COUNT_TTL:
+            self._doc_count = self.vector_store._collection.count()
+            self._doc_count_at = now
+        return self._doc_count
+    
+    def register_change_listener(self, callback: Callable[[], None]) -> None:
+        """Register a callback invoked whenever the collection contents change"""
+        self._change_listeners.append(callback)
+    
+    def _notify_change(self) -> None:
+        """Invoke all registered change listeners"""
+        self._doc_count = None
+        for callback in self._change_listeners:
             try:
-                # Check if file exists
-                if not os.path.exists(file_path):
-                    raise FileNotFoundError(f"File not found: {file_path}")
-                
-                logger.info(f"Starting to process: {file_path}")
-                
-                # Load document
-                documents = self.document_loader.load_document(file_path)
-                
-                if not documents:
-                    result['status'] = 'failed'
-                    result['error'] = 'No documents loaded'
-                    results.append(result)
-                    continue
-                
-                logger.info(f"Loaded {len(documents)} documents from {file_path}")
-                
-                # Split into chunks
-                chunks = self.text_splitter.split_documents(documents)
-                all_chunks.extend(chunks)
-                
-                result['chunks_created'] = len(chunks)
-                logger.info(f"Processed {file_path}: {len(documents)} documents -> {len(chunks)} chunks")
-                
+                callback()
             except Exception as e:
+                logger.warning(f"Change listener failed: {e}")
+    
+    def _split_documents(self, documents: List[Document]) -> List[Document]:
+        """Split documents into chunks, fanning large recursive splits out to worker processes"""
+        if config.TEXT_SPLITTER != "recursive" or len(documents) <= 8:
+            return self.text_splitter.split_documents(documents)
+        
+        # One short-lived pool per call, no larger than the work, so no idle processes outlive the upload.
+        # spawn avoids forking a process that already holds torch/Chroma threads; spawned children
+        # re-import __main__, which is why the manager is built lazily.
+        chunks = []
+        texts = [doc.page_content for doc in documents]
+        with ProcessPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, len(documents)), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            for doc, pieces in zip(documents, pool.map(self.text_splitter.split_text, texts)):
+                chunks.extend(Document(page_content=piece, metadata=dict(doc.metadata)) for piece in pieces)
+        return chunks
+    
+    def _process_file(self, file_path: str) -> Tuple[dict, List[Document]]:
+        """Load and split a single file, returning its result entry and chunks"""
+        result = {
+            'filename': Path(file_path).name,
+            'status': 'success',
+            'chunks_created': 0,
+            'error': None
+        }
+        chunks = []
+        
+        try:
+            # Check if file exists
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"File not found: {file_path}")
+            
+            logger.info(f"Starting to process: {file_path}")
+            
+            # Load document
+            documents = self.document_loader.load_document(file_path)
+            
+            if not documents:
                 result['status'] = 'failed'
-                result['error'] = str(e)
-                logger.error(f"Failed to process {file_path}: {e}")
+                result['error'] = 'No documents loaded'
+                return result, chunks
+            
+            logger.info(f"Loaded {len(documents)} documents from {file_path}")
+            
+            # Split into chunks
+            chunks = self._split_documents(documents)
+            
+            result['chunks_created'] = len(chunks)
+            logger.info(f"Processed {file_path}: {len(documents)} documents -> {len(chunks)} chunks")
             
-            results.append(result)
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+            logger.error(f"Failed to process {file_path}: {e}")
+        
+        return result, chunks
+    
+    def _load_chunks(self, file_paths: List[str]) -> Tuple[List[dict], List[Document]]:
+        """Load and split files in parallel, returning per-file results and all chunks"""
+        results = []
+        all_chunks = []
+        if file_paths:
+            with ThreadPoolExecutor(max_workers=min(8, len(file_paths))) as executor:
+                for result, chunks in executor.map(self._process_file, file_paths):
+                    results.append(result)
+                    all_chunks.extend(chunks)
+        return results, all_chunks
+    
+    def _write_chunks(self, vector_store: Chroma, all_chunks: List[Document], batch_size: int) -> None:
+        """Embed chunks and upsert them into vector_store (raises on failure)"""
+        logger.info(f"Starting to add {len(all_chunks)} chunks to vector store...")
+        
+        # Deterministic ids make re-uploads idempotent; identical chunks from one source collapse.
+        # Build the parallel upsert columns in a single pass.
+        ids, texts, metadatas = [], [], []
+        seen = set()
+        for chunk in all_chunks:
+            cid = chunk_hash(chunk)
+            if cid in seen:
+                continue
+            seen.add(cid)
+            ids.append(cid)
+            texts.append(chunk.page_content)
+            metadatas.append(chunk.metadata)
+        
+        # Embed everything not already cached in one call (batched internally by EMBED_BATCH_SIZE)
+        embeddings = self.embedding_cache.embed(texts, self.embeddings.embed_documents)
+        
+        # Write to Chroma in batches, bypassing the LangChain wrapper
+        self._doc_count = None
+        for i in range(0, len(ids), batch_size):
+            end = i + batch_size
+            self._upsert_batch_with_retry(
+                vector_store, ids[i:end], embeddings[i:end], texts[i:end], metadatas[i:end]
+            )
+            logger.info(f"Added batch {i//batch_size + 1}/{(len(ids)-1)//batch_size + 1}")
+        
+        logger.info(f"Successfully added {len(all_chunks)} chunks to vector store")
+    
+    def _mark_store_failure(self, results: List[dict], error: Exception) -> None:
+        """Flag files that loaded fine but could not be written to the vector store"""
+        for result in results:
+            if result['status'] == 'success':
+                result['status'] = 'failed'
+                result['error'] = f"Failed to add to vector store: {str(error)}"
+    
+    def add_files(self, file_paths: List[str], batch_size: int = 1000) -> List[dict]:
+        """Add files to vector store with detailed results (pass all files in one call so chunks batch together)"""
+        with self._write_lock:
+            return self._add_files(file_paths, batch_size)
+    
+    def _add_files(self, file_paths: List[str], batch_size: int) -> List[dict]:
+        """Unlocked implementation of add_files (caller holds _write_lock)"""
+        results, all_chunks = self._load_chunks(file_paths)
         
         # Add all chunks to vector store in batch
         if all_chunks:
             try:
-                logger.info(f"Starting to add {len(all_chunks)} chunks to vector store...")
-                
-                # Add in smaller batches to avoid timeouts
-                batch_size = 100
-                for i in range(0, len(all_chunks), batch_size):
-                    batch = all_chunks[i:i + batch_size]
-                    self.vector_store.add_documents(batch)
-                    logger.info(f"Added batch {i//batch_size + 1}/{(len(all_chunks)-1)//batch_size + 1}")
-                    time.sleep(0.1)  # Small delay to prevent overwhelming
-                
-                logger.info(f"Successfully added {len(all_chunks)} chunks to vector store")
+                self._write_chunks(self.vector_store, all_chunks, batch_size)
+                self._notify_change()
                 
                 # Verify the documents were added
                 try:
-                    doc_count = self.vector_store._collection.count()
+                    doc_count = self.document_count()
                     logger.info(f"Vector store now contains {doc_count} documents")
                 except Exception as e:
                     logger.warning(f"Could not verify document count: {e}")
                     
             except Exception as e:
                 logger.error(f"Failed to add documents to vector store: {e}")
-                for result in results:
-                    if result['status'] == 'success':
-                        result['status'] = 'failed'
-                        result['error'] = f"Failed to add to vector store: {str(e)}"
+                self._mark_store_failure(results, e)
         
         return results
     
-    def reset_and_add_files(self, file_paths: List[str]) -> List[dict]:
-        """Clear vector store and add new files"""
+    def _upsert_batch_with_retry(
+        self, vector_store: Chroma, ids: List[str], embeddings: List[List[float]], texts: List[str],
+        metadatas: List[dict], attempts: int = 3
+    ) -> None:
+        """Upsert a batch into the collection, backing off exponentially only on transient failures"""
+        for attempt in range(attempts):
+            try:
+                vector_store._collection.upsert(
+                    ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas
+                )
+                return
+            except Exception as e:
+                if attempt == attempts - 1:
+                    raise
+                delay = 0.1 * 2 ** attempt
+                logger.warning(f"Adding batch failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+    
+    def reset_and_add_files(self, file_paths: List[str], batch_size: int = 1000) -> List[dict]:
+        """Replace the vector store contents with new files, swapping collections only once the new one is built"""
+        with self._write_lock:
+            return self._reset_and_add_files(file_paths, batch_size)
+    
+    def _reset_and_add_files(self, file_paths: List[str], batch_size: int) -> List[dict]:
+        """Unlocked implementation of reset_and_add_files (caller holds _write_lock)"""
         logger.info("Resetting vector store...")
+        results, all_chunks = self._load_chunks(file_paths)
         
+        # Build the replacement under a temporary name while searches keep using the current collection
+        new_store = None
         try:
-            # Clear existing collection
-            self.vector_store.delete_collection()
-            logger.info("Cleared existing vector store collection")
+            new_store = self._open_store(f"{COLLECTION_NAME}_new_{uuid4().hex[:8]}")
+            if all_chunks:
+                self._write_chunks(new_store, all_chunks, batch_size)
         except Exception as e:
-            logger.warning(f"Failed to clear collection: {e}")
+            logger.error(f"Failed to build replacement collection, keeping the existing one: {e}")
+            if new_store is not None:
+                self._drop_temp_store(new_store)
+            self._mark_store_failure(results, e)
+            return results
         
-        # Reinitialize vector store
+        # Swap by renaming only: move the old collection aside, give the new one its name, then
+        # drop the backup. The old data is deleted only once the new collection owns COLLECTION_NAME.
+        old_store = self.vector_store
+        backup_name = f"{COLLECTION_NAME}_old_{uuid4().hex[:8]}"
         try:
-            self.vector_store = Chroma(
-                collection_name="rag_collection",
-                embedding_function=self.embeddings,
-                persist_directory=config.CHROMA_PERSIST_DIR,
-            )
-            logger.info("Reinitialized vector store")
+            old_store._collection.modify(name=backup_name)
         except Exception as e:
-            logger.error(f"Failed to reinitialize vector store: {e}")
-            raise
+            logger.error(f"Failed to move the existing collection aside, keeping it: {e}")
+            self._drop_temp_store(new_store)
+            self._mark_store_failure(results, e)
+            return results
         
-        return self.add_files(file_paths)
+        try:
+            new_store._collection.modify(name=COLLECTION_NAME)
+        except Exception as e:
+            logger.error(f"Failed to rename the new collection, rolling back: {e}")
+            try:
+                old_store._collection.modify(name=COLLECTION_NAME)
+            except Exception as rollback_error:
+                logger.error(f"Rollback failed, previous data is kept under {backup_name}: {rollback_error}")
+            self._drop_temp_store(new_store)
+            self._mark_store_failure(results, e)
+            return results
+        
+        self.vector_store = new_store
+        logger.info("Swapped in new vector store collection")
+        try:
+            old_store._client.delete_collection(backup_name)
+        except Exception as e:
+            logger.warning(f"Failed to delete previous collection {backup_name}: {e}")
+        self._notify_change()
+        
+        return results
+    
+    def _drop_temp_store(self, store: Chroma) -> None:
+        """Delete a temporary collection, logging rather than raising on failure"""
+        try:
+            store.delete_collection()
+        except Exception as e:
+            logger.warning(f"Failed to delete temporary collection: {e}")
+    
+    def similarity_search(self, query: str, k: int = None, filter: Optional[dict] = None) -> List[Document]:
+        """Search for similar documents, optionally restricted by a Chroma metadata filter"""
+        return [doc for doc, _ in self._search(query, k, filter, relevance=False)]
+    
+    def similarity_search_with_scores(
+        self, query: str, k: int = None, filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """Search for similar documents, returning (document, relevance score) pairs, best first"""
+        return self._search(query, k, filter, relevance=True)
     
-    def similarity_search(self, query: str, k: int = None) -> List[Document]:
-        """Search for similar documents"""
+    def _search(
+        self, query: str, k: Optional[int], filter: Optional[dict], relevance: bool
+    ) -> List[Tuple[Document, float]]:
+        """Run a search returning relevance scores, or raw distances (no [0, 1] range warning) if not relevance"""
         if k is None:
             k = config.SIMILARITY_TOP_K
         
         try:
-            logger.info(f"Performing similarity search for: '{query}' (k={k})")
+            logger.info("Performing similarity search for: '%s' (k=%d)", query, k)
             
             # First, check if we have any documents
             try:
-                doc_count = self.vector_store._collection.count()
-                logger.info(f"Vector store has {doc_count} documents")
+                doc_count = self.document_count()
                 if doc_count == 0:
                     logger.warning("Vector store is empty - no documents to search")
                     return []
             except Exception as e:
                 logger.warning(f"Could not check document count: {e}")
             
-            results = self.vector_store.similarity_search(query, k=k)
-            logger.info(f"Found {len(results)} relevant documents")
+            if relevance:
+                results = self.vector_store.similarity_search_with_relevance_scores(query, k=k, filter=filter)
+            else:
+                results = self.vector_store.similarity_search_with_score(query, k=k, filter=filter)
+            logger.info("Found %d relevant documents", len(results))
             
             # Log what we found for debugging
-            for i, doc in enumerate(results):
-                logger.info(f"Result {i+1}: {doc.metadata.get('source', 'Unknown')} - {doc.page_content[:100]}...")
-                
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, (doc, score) in enumerate(results, start=1):
+                    logger.debug("Result %d (%.3f): %s - %s...", i, score, doc.metadata.get('source', 'Unknown'), doc.page_content[:100])
+            
             return results
         except Exception as e:
+            # Raise rather than return [] so callers can tell a failed search from an empty result
             logger.error(f"Similarity search failed: {e}")
-            return []
+            raise
     
     def get_collection_info(self) -> dict:
         """Get information about the vector store collection"""
         try:
             # Try to get document count
-            doc_count = self.vector_store._collection.count()
+            doc_count = self.document_count()
             return {
                 'document_count': doc_count,
                 'persist_directory': config.CHROMA_PERSIST_DIR,
@@ -335,5 +630,7 @@ class VectorStoreManager:
                 'error': str(e)
             }
 
-# Global instance
-vector_store_manager = VectorStoreManager()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_vector_store_manager() -> VectorStoreManager:
+    """Global vector store manager, created on first use (never at import time)"""
+    return VectorStoreManager()
\ No newline at end of file